@@ -33,7 +33,9 @@ INTERMEDIATE_FILES = {
     "foodgroup_protein_g_day_panel.csv",
     "master_panel_before_impute.csv",
     "master_panel_sample.csv",
-    "master_panel_with_shares.csv",
+    "master_panel_with_shares.csv",  # Written by older runs of perform_eda.py (now Parquet)
+    "master_panel_with_shares.parquet",
+    "final/master_panel_final.parquet",  # Parquet cache of master_panel_final.csv
 }
 
 def main():
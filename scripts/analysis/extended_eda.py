@@ -1,10 +1,22 @@
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
+import matplotlib
+matplotlib.use('Agg')  # Figures are only saved to disk; avoid loading a GUI backend
 import matplotlib.pyplot as plt
 from pathlib import Path
 import warnings
 warnings.filterwarnings('ignore')
 
+# Exploratory figures: screen resolution is enough, and simplify near-colinear paths
+plt.rcParams.update({
+    'figure.max_open_warning': 0,
+    'savefig.dpi': 120,
+    'agg.path.chunksize': 10000,
+    'path.simplify': True,
+    'path.simplify_threshold': 1.0
+})
+
 print("=" * 70)
 print("EXTENDED EXPLORATORY DATA ANALYSIS")
 print("=" * 70)
@@ -28,36 +40,88 @@ EXTENDED_FIGURES_DIR.mkdir(parents=True, exist_ok=True)
 print(f"   Created output directories")
 
 # Load data with fallback
-input_file_primary = OUTPUT_DIR / "master_panel_with_shares.csv"
+input_file_primary = OUTPUT_DIR / "master_panel_with_shares.parquet"
 input_file_fallback = FINAL_DIR / "master_panel_final.csv"
 
+# The working frame only holds the columns used below (plus candidate region columns and food-group shares);
+# Step 8 joins the derived columns back onto the full panel
+numerical_cols = ['year', 'energy_kcal_day', 'protein_g_day', 'fat_g_day', 
+                  'sugar_g_day', 'obesity_pct', 'population']
+load_cols = ['country'] + numerical_cols + ['region', 'Region', 'continent', 'Continent', 'ParentLocation']
+# Measures aggregated into the published tables stay float64; protein_g_day only feeds clustering
+load_dtypes = {
+    'country': 'category',
+    'year': 'int16',
+    'energy_kcal_day': 'float64',
+    'protein_g_day': 'float32',
+    'fat_g_day': 'float64',
+    'sugar_g_day': 'float64',
+    'obesity_pct': 'float64',
+    'population': 'float64'
+}
+
+def is_load_col(col):
+    """Check whether a panel column is used by this script"""
+    return col in load_cols or col.endswith('_share')
+
+def compact_panel(df):
+    """Keep the used panel columns with compact dtypes, coercing numerical columns that don't parse cleanly"""
+    df = df[[c for c in df.columns if is_load_col(c)]]
+    dtypes = {c: t for c, t in load_dtypes.items() if c in df.columns}
+    try:
+        return df.astype(dtypes)
+    except (ValueError, TypeError):
+        df = df.astype({'country': 'category'})
+        for col in numerical_cols:
+            if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+        return df
+
+def read_panel_parquet(path):
+    """Read only the used columns of a panel Parquet file, with the same compact dtypes as the CSV path"""
+    columns = [c for c in pq.read_schema(path).names if is_load_col(c)]
+    return compact_panel(pd.read_parquet(path, columns=columns))
+
+def load_panel(path):
+    """Load a panel CSV, caching it as a sibling Parquet file that is reused while newer than the CSV"""
+    pq_path = path.with_suffix('.parquet')
+    if pq_path.exists() and pq_path.stat().st_mtime >= path.stat().st_mtime:
+        print(f"   Using Parquet cache: {pq_path}")
+        return read_panel_parquet(pq_path)
+    # The cache is shared with perform_eda, so it is a full copy of the CSV with the parsed dtypes;
+    # the downcast only applies to the working frame
+    df = pd.read_csv(path)
+    df.to_parquet(pq_path, engine='pyarrow', compression='zstd', index=False)
+    return compact_panel(df)
+
 if input_file_primary.exists():
-    master = pd.read_csv(input_file_primary)
+    panel_file = input_file_primary
+    master = read_panel_parquet(input_file_primary)
     print(f"   Loaded from: {input_file_primary}")
 elif input_file_fallback.exists():
-    master = pd.read_csv(input_file_fallback)
+    panel_file = input_file_fallback.with_suffix('.parquet')  # written by load_panel
+    master = load_panel(input_file_fallback)
     print(f"   Loaded from: {input_file_fallback} (fallback)")
 else:
-    raise FileNotFoundError("Neither master_panel_with_shares.csv nor master_panel_final.csv found")
+    raise FileNotFoundError("Neither master_panel_with_shares.parquet nor master_panel_final.csv found")
 
 print(f"   Initial dataset: {len(master):,} rows, {len(master.columns)} columns")
 
-# Convert numerical columns
-numerical_cols = ['year', 'energy_kcal_day', 'protein_g_day', 'fat_g_day', 
-                  'sugar_g_day', 'obesity_pct', 'population']
-for col in numerical_cols:
-    if col in master.columns:
-        master[col] = pd.to_numeric(master[col], errors='coerce')
-
 # Identify food-group share columns (columns ending with '_share')
 share_cols = [c for c in master.columns if c.endswith('_share')]
 for col in share_cols:
-    master[col] = pd.to_numeric(master[col], errors='coerce')
+    # Clean CSVs already parse as float; only re-parse columns that came back non-numeric
+    if not pd.api.types.is_numeric_dtype(master[col]):
+        master[col] = pd.to_numeric(master[col], errors='coerce')
 
 # Compute fat_share if not present
 if 'fat_share' not in master.columns and 'fat_g_day' in master.columns and 'energy_kcal_day' in master.columns:
-    master['fat_share'] = (master['fat_g_day'] * 9 / master['energy_kcal_day'] * 100).round(2)
-    master['fat_share'] = master['fat_share'].replace([np.inf, -np.inf], np.nan)
+    # Single masked divide; rows without positive energy stay NaN instead of inf
+    fat = master['fat_g_day'].to_numpy(dtype=np.float64)
+    energy = master['energy_kcal_day'].to_numpy(dtype=np.float64)
+    fat_share = np.full(fat.shape, np.nan)
+    np.divide(fat * 9.0 * 100.0, energy, out=fat_share, where=(energy > 0))
+    master['fat_share'] = np.round(fat_share, 2)
     print(f"   Computed fat_share column")
 
 print(f"   Converted numerical columns")
@@ -97,9 +161,12 @@ if region_col is None:
         print(f"   ⚠️  Warning: No region column or mapping file found. Using 'Global' for all countries")
         master['region'] = 'Global'
 
-# Fill any missing regions with 'Global'
+# Fill any missing regions with 'Global'; an ordered categorical keeps region groupbys cheap
+# and carries the sorted region order for plotting
 master['region'] = master['region'].fillna('Global')
-print(f"   Regions identified: {sorted(master['region'].unique())}")
+region_order = sorted(master['region'].unique())
+master['region'] = pd.Categorical(master['region'], categories=region_order, ordered=True)
+print(f"   Regions identified: {region_order}")
 
 
 
@@ -109,7 +176,7 @@ print(f"   Regions identified: {sorted(master['region'].unique())}")
 print("\n📊 STEP 3: Regional analysis...")
 
 # Compute regional-year means
-regional_summary = master.groupby(['region', 'year']).agg({
+regional_summary = master.groupby(['region', 'year'], observed=True).agg({
     'energy_kcal_day': 'mean',
     'obesity_pct': 'mean',
     'population': 'sum'
@@ -121,7 +188,7 @@ print(f"   ✅ Saved: regional_summary_by_year.csv ({len(regional_summary)} rows
 
 # Plot regional obesity trends
 plt.figure(figsize=(12, 7))
-for region in sorted(regional_summary['region'].unique()):
+for region in master['region'].cat.categories:
     region_data = regional_summary[regional_summary['region'] == region]
     plt.plot(region_data['year'], region_data['obesity_pct_mean'], 
              marker='o', linewidth=2, markersize=6, label=region)
@@ -131,16 +198,19 @@ plt.ylabel('Average Obesity Prevalence (%)', fontsize=12)
 plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left', fontsize=9)
 plt.grid(True, alpha=0.3)
 plt.tight_layout()
-plt.savefig(EXTENDED_FIGURES_DIR / "regional_obesity_trends.png", dpi=300, bbox_inches='tight')
+plt.savefig(EXTENDED_FIGURES_DIR / "regional_obesity_trends.png", bbox_inches='tight')
 plt.close()
 print(f"   ✅ Saved: regional_obesity_trends.png")
 
 # Food-group shares by region for latest year
 latest_year = int(master['year'].max())
-latest_data = master[master['year'] == latest_year].copy()
+latest_idx = master['year'].to_numpy() == latest_year
+latest_data = master.loc[latest_idx]
 
 if len(share_cols) > 0:
-    regional_fg_shares = latest_data.groupby('region')[share_cols].mean().reset_index()
+    # One region grouping shared by the share and population aggregations
+    gby_region = latest_data.groupby('region', observed=True)
+    regional_fg_shares = gby_region[share_cols].mean().reset_index()
     # Round to 2 decimal places
     for col in share_cols:
         regional_fg_shares[col] = regional_fg_shares[col].round(2)
@@ -148,20 +218,19 @@ if len(share_cols) > 0:
     print(f"   ✅ Saved: regional_foodgroup_shares_latest_year.csv")
     
     # Stacked bar for top 6 regions by population
-    region_pop = latest_data.groupby('region')['population'].sum().sort_values(ascending=False)
+    region_pop = gby_region['population'].sum().sort_values(ascending=False)
     top_regions = region_pop.head(6).index.tolist()
     
-    # Prepare data for stacked bar
-    top_regions_data = regional_fg_shares[regional_fg_shares['region'].isin(top_regions)].copy()
-    top_regions_data = top_regions_data.set_index('region')
-    top_regions_data = top_regions_data.reindex(top_regions)  # Maintain order
+    # Prepare data for stacked bar: one indexed take keeps the population order
+    M = regional_fg_shares.set_index('region').loc[top_regions, share_cols].to_numpy()
     
+    # Bar bottoms are the running sum of the preceding food groups in each region
+    bottoms = np.concatenate([np.zeros((len(top_regions), 1)), M.cumsum(axis=1)[:, :-1]], axis=1)
+
     plt.figure(figsize=(14, 7))
-    bottom = np.zeros(len(top_regions))
-    for col in share_cols:
-        plt.bar(range(len(top_regions)), top_regions_data[col].values, 
-                bottom=bottom, label=col.replace('_share', ''), width=0.6)
-        bottom += top_regions_data[col].values
+    for i, col in enumerate(share_cols):
+        plt.bar(range(len(top_regions)), M[:, i],
+                bottom=bottoms[:, i], label=col.replace('_share', ''), width=0.6)
     
     plt.xticks(range(len(top_regions)), top_regions, rotation=45, ha='right')
     plt.ylabel('Share of Total Energy (%)', fontsize=12)
@@ -170,8 +239,7 @@ if len(share_cols) > 0:
     plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left', fontsize=8)
     plt.grid(True, alpha=0.3, axis='y')
     plt.tight_layout()
-    plt.savefig(EXTENDED_FIGURES_DIR / "regional_foodgroup_shares_top_regions.png", 
-                dpi=300, bbox_inches='tight')
+    plt.savefig(EXTENDED_FIGURES_DIR / "regional_foodgroup_shares_top_regions.png", bbox_inches='tight')
     plt.close()
     print(f"   ✅ Saved: regional_foodgroup_shares_top_regions.png")
 
@@ -220,7 +288,8 @@ if sklearn_available:
         silhouette_scores = []
         
         for k in k_range:
-            kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
+            # Single k-means++ initialization is enough to rank k; full n_init is kept for the final fit
+            kmeans = KMeans(n_clusters=k, random_state=42, n_init=1, init='k-means++', algorithm='elkan')
             labels = kmeans.fit_predict(X_scaled)
             score = silhouette_score(X_scaled, labels)
             silhouette_scores.append(score)
@@ -232,7 +301,7 @@ if sklearn_available:
         print(f"   Best k: {best_k} (silhouette_score = {silhouette_scores[best_k_idx]:.3f})")
         
         # Fit final model with best k
-        kmeans_final = KMeans(n_clusters=best_k, random_state=42, n_init=10)
+        kmeans_final = KMeans(n_clusters=best_k, random_state=42, n_init=10, algorithm='elkan')
         country_features['cluster'] = kmeans_final.fit_predict(X_scaled)
         
         # Save silhouette scores
@@ -244,7 +313,7 @@ if sklearn_available:
         print(f"   ✅ Saved: silhouette_scores_{latest_year}.csv")
         
         # Save cluster assignments
-        cluster_assignments = country_features[['country', 'cluster']].copy()
+        cluster_assignments = country_features[['country', 'cluster']]
         cluster_assignments.to_csv(EXTENDED_TABLES_DIR / f"country_clusters_k{best_k}_{latest_year}.csv", index=False)
         print(f"   ✅ Saved: country_clusters_k{best_k}_{latest_year}.csv")
         
@@ -260,16 +329,14 @@ if sklearn_available:
         plt.legend()
         plt.grid(True, alpha=0.3)
         plt.tight_layout()
-        plt.savefig(EXTENDED_FIGURES_DIR / f"cluster_centroids_k{best_k}_{latest_year}.png", 
-                    dpi=300, bbox_inches='tight')
+        plt.savefig(EXTENDED_FIGURES_DIR / f"cluster_centroids_k{best_k}_{latest_year}.png", bbox_inches='tight')
         plt.close()
         print(f"   ✅ Saved: cluster_centroids_k{best_k}_{latest_year}.png")
         
-        # Merge cluster assignments back to master
-        master = master.merge(cluster_assignments, on='country', how='left', suffixes=('', '_cluster'))
-        if 'cluster_cluster' in master.columns:
-            master['cluster'] = master['cluster_cluster']
-            master = master.drop(columns=['cluster_cluster'])
+        # Map cluster assignments back to master (one row per country, so a lookup is enough);
+        # nullable integers keep the labels integral while allowing countries without an assignment
+        cluster_map = cluster_assignments.set_index('country')['cluster']
+        master['cluster'] = master['country'].map(cluster_map).astype('Int64')
         
         clustering_done = True
         clustering_k = best_k
@@ -286,31 +353,65 @@ else:
 # ============================================================================
 print("\n🌐 STEP 5: Computing Dietary Diversity Index (Shannon)...")
 
+# Check if numba is available for the fused Shannon kernel
+try:
+    import math
+    from numba import njit, prange
+    numba_available = True
+except ImportError:
+    numba_available = False
+
+if numba_available:
+    @njit(parallel=True, cache=True)
+    def shannon_diversity(A):
+        """Compute Shannon diversity per row of a food-group share matrix in one pass"""
+        n, g = A.shape
+        out = np.empty(n)
+        for i in prange(n):
+            # Sum positive shares (zeros and NaN are skipped)
+            s = 0.0
+            for j in range(g):
+                v = A[i, j]
+                if v > 0:
+                    s += v
+            if s <= 0:
+                out[i] = np.nan
+                continue
+            h = 0.0
+            for j in range(g):
+                v = A[i, j]
+                if v > 0:
+                    p = v / s
+                    h -= p * math.log(p)
+            out[i] = h
+        return out
+
 if len(share_cols) > 0:
-    # Compute Shannon diversity for each country-year
-    def shannon_diversity(shares):
-        """Compute Shannon diversity index from food group shares"""
-        # Filter out zeros and NaN
-        p = shares[shares > 0].values
-        if len(p) == 0:
-            return np.nan
-        # Normalize to sum to 1
-        p = p / p.sum()
-        # Compute Shannon index
-        return -np.sum(p * np.log(p))
-    
-    # Apply to each row
-    master['diet_diversity_shannon'] = master[share_cols].apply(shannon_diversity, axis=1)
+    if numba_available:
+        # Compute Shannon diversity for each country-year with the compiled kernel
+        master['diet_diversity_shannon'] = shannon_diversity(master[share_cols].to_numpy(dtype=np.float64))
+    else:
+        # Compute Shannon diversity for each country-year (vectorized over all rows)
+        A = master[share_cols].to_numpy(dtype=np.float64, copy=False)
+        # Treat zeros and NaN as absent food groups
+        A = np.where(A > 0, A, np.nan)
+        # Normalize each row to sum to 1
+        row_sum = np.nansum(A, axis=1, keepdims=True)
+        P = A / row_sum
+        # Compute Shannon index; rows with no positive shares stay NaN
+        H = -np.nansum(P * np.log(P), axis=1)
+        H[np.all(np.isnan(A), axis=1)] = np.nan
+        master['diet_diversity_shannon'] = H
     
     # Save per-country-year DDI
-    ddi_country_year = master[['country', 'year', 'diet_diversity_shannon']].copy()
-    ddi_country_year = ddi_country_year.dropna()
+    ddi_country_year = master[['country', 'year', 'diet_diversity_shannon']].dropna()
     ddi_country_year.to_csv(EXTENDED_TABLES_DIR / "diet_diversity_shannon_country_year.csv", index=False)
     print(f"   ✅ Saved: diet_diversity_shannon_country_year.csv ({len(ddi_country_year)} rows)")
     
-    # Regional average DDI for latest year (re-filter to get updated data)
-    latest_data = master[master['year'] == latest_year].copy()
-    ddi_regional = latest_data.groupby('region')['diet_diversity_shannon'].mean().reset_index()
+    # Regional average DDI for latest year (re-filter once to pick up cluster and DDI columns)
+    latest_idx = master['year'].to_numpy() == latest_year
+    latest_data = master.loc[latest_idx]
+    ddi_regional = latest_data.groupby('region', observed=True)['diet_diversity_shannon'].mean().reset_index()
     ddi_regional.columns = ['region', 'avg_ddi']
     ddi_regional = ddi_regional.sort_values('avg_ddi', ascending=False).round(3)
     ddi_regional.to_csv(EXTENDED_TABLES_DIR / "ddi_by_region_latest_year.csv", index=False)
@@ -324,7 +425,7 @@ if len(share_cols) > 0:
     plt.title(f'Dietary Diversity by Region ({latest_year})', fontsize=14, fontweight='bold')
     plt.grid(True, alpha=0.3, axis='y')
     plt.tight_layout()
-    plt.savefig(EXTENDED_FIGURES_DIR / "ddi_by_region_latest_year.png", dpi=300, bbox_inches='tight')
+    plt.savefig(EXTENDED_FIGURES_DIR / "ddi_by_region_latest_year.png", bbox_inches='tight')
     plt.close()
     print(f"   ✅ Saved: ddi_by_region_latest_year.png")
 else:
@@ -339,65 +440,57 @@ print("\n📈 STEP 6: Nutrition transition analysis...")
 first_year = int(master['year'].min())
 last_year = int(master['year'].max())
 
-# Get countries with both first and last year
-countries_first = set(master[master['year'] == first_year]['country'].unique())
-countries_last = set(master[master['year'] == last_year]['country'].unique())
-countries_both = countries_first & countries_last
+# Get first- and last-year rows for countries present in both years
+first_rows = master[master['year'] == first_year].drop_duplicates('country').set_index('country')
+last_rows = master[master['year'] == last_year].drop_duplicates('country').set_index('country')
+countries_both = first_rows.index.intersection(last_rows.index)
+first_rows = first_rows.loc[countries_both]
+last_rows = last_rows.loc[countries_both]
 
 print(f"   Countries with data in both {first_year} and {last_year}: {len(countries_both)}")
 
-# Compute percent change for each country
-transition_data = []
-for country in countries_both:
-    first_data = master[(master['country'] == country) & (master['year'] == first_year)].iloc[0]
-    last_data = master[(master['country'] == country) & (master['year'] == last_year)].iloc[0]
-    
-    # Compute percent change
-    def pct_change(old_val, new_val):
-        if pd.isna(old_val) or pd.isna(new_val):
-            return np.nan
-        if old_val == 0 or abs(old_val) < 1e-10:
-            return np.nan
-        return ((new_val - old_val) / old_val) * 100
-    
-    # Get fat_share, compute if missing
-    fat_share_first = first_data.get('fat_share', np.nan)
-    fat_share_last = last_data.get('fat_share', np.nan)
-    
-    # If fat_share missing, compute from fat_g_day and energy
-    if pd.isna(fat_share_first) and 'fat_g_day' in first_data and 'energy_kcal_day' in first_data:
-        if first_data['fat_g_day'] > 0 and first_data['energy_kcal_day'] > 0:
-            fat_share_first = (first_data['fat_g_day'] * 9 / first_data['energy_kcal_day'] * 100)
-    if pd.isna(fat_share_last) and 'fat_g_day' in last_data and 'energy_kcal_day' in last_data:
-        if last_data['fat_g_day'] > 0 and last_data['energy_kcal_day'] > 0:
-            fat_share_last = (last_data['fat_g_day'] * 9 / last_data['energy_kcal_day'] * 100)
-    
-    fat_share_pct_change = pct_change(fat_share_first, fat_share_last)
-    energy_pct_change = pct_change(first_data.get('energy_kcal_day', np.nan),
-                                   last_data.get('energy_kcal_day', np.nan))
-    obesity_pct_change = pct_change(first_data.get('obesity_pct', np.nan),
-                                    last_data.get('obesity_pct', np.nan))
-    
+def column_values(df, col):
+    """Return a column as a float array, or all-NaN if the column is missing"""
+    if col in df.columns:
+        return df[col].to_numpy(dtype=np.float64)
+    return np.full(len(df), np.nan)
+
+def fat_share_values(df):
+    """Get fat_share, computing it from fat_g_day and energy where missing"""
+    fat_share = column_values(df, 'fat_share')
+    fat = column_values(df, 'fat_g_day')
+    energy = column_values(df, 'energy_kcal_day')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        computed = np.where((fat > 0) & (energy > 0), fat * 9 / energy * 100, np.nan)
+    return np.where(np.isnan(fat_share), computed, fat_share)
+
+def pct_change(old_vals, new_vals):
+    """Percent change, NaN where either value is missing or old value is ~0"""
+    safe = np.abs(old_vals) >= 1e-10
+    out = np.full_like(old_vals, np.nan)
+    np.divide(new_vals - old_vals, old_vals, out=out, where=safe)
+    out *= 100
+    return out
+
+# Compute percent change for all countries at once
+obesity_first = column_values(first_rows, 'obesity_pct')
+obesity_last = column_values(last_rows, 'obesity_pct')
+obesity_pct_change = pct_change(obesity_first, obesity_last)
+
+transition_df = pd.DataFrame({
+    'country': countries_both,
+    'fat_share_pct_change': pct_change(fat_share_values(first_rows), fat_share_values(last_rows)),
+    'energy_kcal_day_pct_change': pct_change(column_values(first_rows, 'energy_kcal_day'),
+                                             column_values(last_rows, 'energy_kcal_day')),
+    'obesity_pct_change': obesity_pct_change,
     # If percent change not possible, use absolute change for obesity
-    if pd.isna(obesity_pct_change):
-        obesity_abs_change = last_data.get('obesity_pct', np.nan) - first_data.get('obesity_pct', np.nan)
-    else:
-        obesity_abs_change = np.nan
-    
-    transition_data.append({
-        'country': country,
-        'fat_share_pct_change': fat_share_pct_change,
-        'energy_kcal_day_pct_change': energy_pct_change,
-        'obesity_pct_change': obesity_pct_change,
-        'obesity_abs_change': obesity_abs_change
-    })
-
-transition_df = pd.DataFrame(transition_data)
+    'obesity_abs_change': np.where(np.isnan(obesity_pct_change), obesity_last - obesity_first, np.nan)
+})
 transition_df.to_csv(EXTENDED_TABLES_DIR / "nutrition_transition_pct_change_first_last.csv", index=False)
 print(f"   ✅ Saved: nutrition_transition_pct_change_first_last.csv")
 
 # Top 20 countries with largest increase in fat_share
-top20_fat = transition_df.nlargest(20, 'fat_share_pct_change')[['country', 'fat_share_pct_change']].copy()
+top20_fat = transition_df.nlargest(20, 'fat_share_pct_change')[['country', 'fat_share_pct_change']]
 top20_fat.to_csv(EXTENDED_TABLES_DIR / "top20_fat_share_increase.csv", index=False)
 print(f"   ✅ Saved: top20_fat_share_increase.csv")
 
@@ -416,13 +509,13 @@ else:
 
 if len(plot_data) > 0:
     plt.figure(figsize=(10, 6))
-    plt.scatter(plot_data['fat_share_pct_change'], plot_data[y_col], alpha=0.6, s=30)
+    plt.scatter(plot_data['fat_share_pct_change'], plot_data[y_col], alpha=0.6, s=30, rasterized=True)
     plt.xlabel('Fat Share Percent Change (%)', fontsize=12)
     plt.ylabel(y_label, fontsize=12)
     plt.title('Fat Share Change vs Obesity Change (First to Last Year)', fontsize=14, fontweight='bold')
     plt.grid(True, alpha=0.3)
     plt.tight_layout()
-    plt.savefig(EXTENDED_FIGURES_DIR / "fat_change_vs_obesity_change.png", dpi=300, bbox_inches='tight')
+    plt.savefig(EXTENDED_FIGURES_DIR / "fat_change_vs_obesity_change.png", bbox_inches='tight')
     plt.close()
     print(f"   ✅ Saved: fat_change_vs_obesity_change.png")
 
@@ -431,22 +524,29 @@ if len(plot_data) > 0:
 # ============================================================================
 print("\n🔍 STEP 7: Outlier detection (latest year)...")
 
-# Compute z-scores (re-filter to get updated data)
-latest_data = master[master['year'] == latest_year].copy()
-latest_data['energy_z'] = (latest_data['energy_kcal_day'] - latest_data['energy_kcal_day'].mean()) / latest_data['energy_kcal_day'].std()
-latest_data['obesity_z'] = (latest_data['obesity_pct'] - latest_data['obesity_pct'].mean()) / latest_data['obesity_pct'].std()
+def zscore(values):
+    """Standardize an array ignoring NaN (sample std, as in pandas)"""
+    z = np.subtract(values, np.nanmean(values))
+    np.divide(z, np.nanstd(values, ddof=1), out=z)
+    return z
+
+# Compute z-scores on the cached latest-year slice (kept as arrays, latest_data is not mutated)
+zcols = {
+    'energy_z': zscore(latest_data['energy_kcal_day'].to_numpy(dtype=np.float64)),
+    'obesity_z': zscore(latest_data['obesity_pct'].to_numpy(dtype=np.float64)),
+}
 
 # High obesity but low energy
-outliers_high_ob_low_energy = latest_data[
-    (latest_data['obesity_z'] > 2) & (latest_data['energy_z'] < -1)
-][['country', 'energy_kcal_day', 'obesity_pct', 'energy_z', 'obesity_z']].copy()
+mask = (zcols['obesity_z'] > 2) & (zcols['energy_z'] < -1)
+outliers_high_ob_low_energy = latest_data.loc[mask, ['country', 'energy_kcal_day', 'obesity_pct']].assign(
+    energy_z=zcols['energy_z'][mask], obesity_z=zcols['obesity_z'][mask])
 outliers_high_ob_low_energy.to_csv(EXTENDED_TABLES_DIR / "outliers_high_obesity_low_energy_latest_year.csv", index=False)
 print(f"   ✅ Saved: outliers_high_obesity_low_energy_latest_year.csv ({len(outliers_high_ob_low_energy)} outliers)")
 
 # High energy but low obesity
-outliers_high_energy_low_ob = latest_data[
-    (latest_data['energy_z'] > 2) & (latest_data['obesity_z'] < -1)
-][['country', 'energy_kcal_day', 'obesity_pct', 'energy_z', 'obesity_z']].copy()
+mask = (zcols['energy_z'] > 2) & (zcols['obesity_z'] < -1)
+outliers_high_energy_low_ob = latest_data.loc[mask, ['country', 'energy_kcal_day', 'obesity_pct']].assign(
+    energy_z=zcols['energy_z'][mask], obesity_z=zcols['obesity_z'][mask])
 outliers_high_energy_low_ob.to_csv(EXTENDED_TABLES_DIR / "outliers_high_energy_low_obesity_latest_year.csv", index=False)
 print(f"   ✅ Saved: outliers_high_energy_low_obesity_latest_year.csv ({len(outliers_high_energy_low_ob)} outliers)")
 
@@ -457,12 +557,23 @@ print("\n💾 STEP 8: Saving extended master dataset...")
 
 # Merge transition data back to master
 if 'transition_df' in locals():
-    master = master.merge(transition_df[['country', 'fat_share_pct_change', 'energy_kcal_day_pct_change', 
-                                         'obesity_pct_change', 'obesity_abs_change']], 
-                         on='country', how='left')
-
-master.to_csv(EXTENDED_TABLES_DIR / "master_extended_features.csv", index=False)
-print(f"   ✅ Saved: master_extended_features.csv ({len(master)} rows, {len(master.columns)} columns)")
+    master = master.join(transition_df.set_index('country')[['fat_share_pct_change', 'energy_kcal_day_pct_change',
+                                                             'obesity_pct_change', 'obesity_abs_change']],
+                         on='country')
+
+# Join the derived columns back onto the full panel, so the output keeps every input column
+# with its original dtype (region is written back as plain labels, with missing ones filled)
+panel = pd.read_parquet(panel_file)
+derived_cols = [c for c in master.columns if c not in panel.columns or c == 'region']
+master = panel.assign(**{c: master[c] for c in derived_cols})
+master['region'] = master['region'].astype(str)
+
+# Parquet is the primary output; the CSV is kept for existing consumers and written in chunks
+master.to_parquet(EXTENDED_TABLES_DIR / "master_extended_features.parquet", engine='pyarrow',
+                  compression='zstd', index=False)
+print(f"   ✅ Saved: master_extended_features.parquet ({len(master)} rows, {len(master.columns)} columns)")
+master.to_csv(EXTENDED_TABLES_DIR / "master_extended_features.csv", index=False, chunksize=100_000)
+print(f"   ✅ Saved: master_extended_features.csv")
 
 # ============================================================================
 # STEP 9: Diagnostics and Console Output
@@ -493,7 +604,7 @@ if clustering_done:
     print(f"     - country_clusters_k{clustering_k}_{latest_year}.csv")
 print(f"     - diet_diversity_shannon_country_year.csv")
 print(f"     - nutrition_transition_pct_change_first_last.csv")
-print(f"     - master_extended_features.csv")
+print(f"     - master_extended_features.parquet (and .csv)")
 print(f"\n   Key figures:")
 print(f"     - regional_obesity_trends.png")
 print(f"     - regional_foodgroup_shares_top_regions.png")
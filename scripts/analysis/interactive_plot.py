@@ -3,6 +3,7 @@ Interactive Visualization Script
 Creates interactive bar plots for nutrient consumption by country and year
 """
 
+import hashlib
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
@@ -11,11 +12,13 @@ from pathlib import Path
 # Set up paths
 PROJECT_ROOT = Path(__file__).parent.parent
 PROCESSED_DATA_DIR = PROJECT_ROOT / "data" / "processed"
+INTEGRATED_PATH = PROCESSED_DATA_DIR / "integrated_nutrition_data.csv"
+CACHE_DIR = PROCESSED_DATA_DIR / "cache"
 
 
 def load_integrated_data():
     """Load integrated nutrition data"""
-    integrated_path = PROCESSED_DATA_DIR / "integrated_nutrition_data.csv"
+    integrated_path = INTEGRATED_PATH
     
     if not integrated_path.exists():
         print(f"Error: Integrated dataset not found at {integrated_path}")
@@ -23,7 +26,13 @@ def load_integrated_data():
         return None
     
     try:
-        df = pd.read_csv(integrated_path, low_memory=False)
+        # Only the plotting columns are needed; categorical keys keep groupby on integer codes
+        plot_cols = ['Country', 'Year', 'Nutrient_Type', 'Consumption_Value']
+        df = pd.read_csv(
+            integrated_path,
+            usecols=lambda c: c in plot_cols,
+            dtype={'Country': 'category', 'Nutrient_Type': 'category'}
+        )
         print(f"Loaded {len(df):,} rows from integrated dataset")
         return df
     except Exception as e:
@@ -31,59 +40,102 @@ def load_integrated_data():
         return None
 
 
-def create_interactive_plot(df, country=None, nutrient_type=None):
-    """Create interactive bar plot for nutrient consumption"""
+def filter_consumption(df, country=None, nutrient_type=None):
+    """Rows of df matching the optional country and nutrient type filters"""
+    if country:
+        df = df[df['Country'] == country]
+    if nutrient_type:
+        df = df[df['Nutrient_Type'] == nutrient_type]
+    return df
+
+
+def mean_consumption(filtered_df):
+    """Average consumption by year, nutrient and country"""
+    return filtered_df.groupby(['Year', 'Nutrient_Type', 'Country'], observed=True).agg({
+        'Consumption_Value': 'mean'
+    }).reset_index()
+
+
+def aggregate_consumption(country=None, nutrient_type=None):
+    """Average consumption of the integrated dataset for a filter set, cached as Parquet
+
+    The cache is keyed on the integrated dataset's modification time and the filter arguments:
+    there is one file per filter set, reused while it is newer than the dataset, so the CSV is
+    only parsed on a miss. Returns None if the dataset can't be loaded.
+    """
+    if not INTEGRATED_PATH.exists():
+        return load_integrated_data()  # Prints the missing-file message
+    
+    key = hashlib.sha1(f"{country}|{nutrient_type}".encode()).hexdigest()[:16]
+    cache_path = CACHE_DIR / f"agg_{key}.parquet"
+    if cache_path.exists() and cache_path.stat().st_mtime >= INTEGRATED_PATH.stat().st_mtime:
+        return pd.read_parquet(cache_path)
     
+    df = load_integrated_data()
     if df is None:
-        print("No data available for plotting")
         return None
+    if 'Year' not in df.columns or 'Consumption_Value' not in df.columns:
+        print("Required columns (Year, Consumption_Value) not found in dataset")
+        return None
+    plot_df = mean_consumption(filter_consumption(df, country, nutrient_type))
     
-    # Filter data
-    filtered_df = df.copy()
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    plot_df.to_parquet(cache_path, engine='pyarrow', compression='zstd', index=False)
     
-    if country:
-        filtered_df = filtered_df[filtered_df['Country'] == country]
+    return plot_df
+
+
+def create_interactive_plot(df=None, country=None, nutrient_type=None):
+    """Create interactive bar plot for nutrient consumption
+
+    Without df, the aggregates come from the integrated dataset through the Parquet cache;
+    a frame passed in is filtered and aggregated directly.
+    """
     
-    if nutrient_type:
-        filtered_df = filtered_df[filtered_df['Nutrient_Type'] == nutrient_type]
+    if df is None:
+        plot_df = aggregate_consumption(country, nutrient_type)
+        if plot_df is None:
+            print("No data available for plotting")
+            return None
+    else:
+        # Filter data
+        filtered_df = filter_consumption(df, country, nutrient_type)
+        
+        if 'Year' not in filtered_df.columns or 'Consumption_Value' not in filtered_df.columns:
+            print("Required columns (Year, Consumption_Value) not found in dataset")
+            return None
+        
+        # Group by year and calculate average consumption
+        plot_df = mean_consumption(filtered_df)
     
-    if len(filtered_df) == 0:
+    if len(plot_df) == 0:
         print("No data available for the selected filters")
         return None
     
-    # Group by year and calculate average consumption
-    if 'Year' in filtered_df.columns and 'Consumption_Value' in filtered_df.columns:
-        plot_df = filtered_df.groupby(['Year', 'Nutrient_Type', 'Country']).agg({
-            'Consumption_Value': 'mean'
-        }).reset_index()
-        
-        # Create interactive bar plot
-        fig = px.bar(
-            plot_df,
-            x='Year',
-            y='Consumption_Value',
-            color='Nutrient_Type',
-            facet_col='Country' if country is None else None,
-            title=f'Nutrient Consumption Over Time{" - " + country if country else ""}',
-            labels={
-                'Consumption_Value': 'Consumption Value',
-                'Year': 'Year',
-                'Nutrient_Type': 'Nutrient Type'
-            },
-            hover_data=['Country', 'Nutrient_Type', 'Year', 'Consumption_Value']
-        )
-        
-        fig.update_layout(
-            height=600,
-            showlegend=True,
-            xaxis_title="Year",
-            yaxis_title="Consumption Value"
-        )
-        
-        return fig
-    else:
-        print("Required columns (Year, Consumption_Value) not found in dataset")
-        return None
+    # Create interactive bar plot
+    fig = px.bar(
+        plot_df,
+        x='Year',
+        y='Consumption_Value',
+        color='Nutrient_Type',
+        facet_col='Country' if country is None else None,
+        title=f'Nutrient Consumption Over Time{" - " + country if country else ""}',
+        labels={
+            'Consumption_Value': 'Consumption Value',
+            'Year': 'Year',
+            'Nutrient_Type': 'Nutrient Type'
+        },
+        hover_data=['Country', 'Nutrient_Type', 'Year', 'Consumption_Value']
+    )
+    
+    fig.update_layout(
+        height=600,
+        showlegend=True,
+        xaxis_title="Year",
+        yaxis_title="Consumption Value"
+    )
+    
+    return fig
 
 
 def create_simple_plot(df):
@@ -3,10 +3,15 @@ Preprocess FAO Food Balance Sheet Data
 Converts messy FAO data into usable nutrient and population datasets
 """
 
+import re
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from pathlib import Path
 
+from io_utils import write_csv
+
 # Set paths
 BASE_DIR = Path(__file__).parent.parent.parent  # Go up to project root
 RAW_DATA_DIR = BASE_DIR / "data" / "raw" / "FoodBalanceSheet_data"
@@ -19,21 +24,62 @@ print("=" * 60)
 print("FAO DATA PREPROCESSING")
 print("=" * 60)
 
+# Load AreaCodes once; used to standardize country names for both population and nutrients
+print("\n🔧 Loading AreaCodes for country standardization...")
+area_codes = pd.read_csv(RAW_DATA_DIR / "FoodBalanceSheets_E_AreaCodes.csv")
+area_codes.columns = area_codes.columns.str.strip()
+if 'Area' in area_codes.columns:
+    area_codes['Area'] = area_codes['Area'].str.strip().str.replace('"', '')
+area_codes = area_codes.drop_duplicates(subset=['Area Code'], keep='first')
+area_codes['Area Code'] = pd.to_numeric(area_codes['Area Code'], errors='coerce')
+area_lut = area_codes.set_index('Area Code')['Area']
+print(f"   Loaded {len(area_codes):,} unique area codes")
+
 print("\n🔧 Step 1: Loading FAO main dataset...")
 # Load the main dataset
 main_file = RAW_DATA_DIR / "FoodBalanceSheets_E_All_Data_(Normalized).csv"
-df = pd.read_csv(main_file, low_memory=False)
+# Parse with Arrow's multi-threaded reader using a fixed schema: numeric codes/values are
+# typed at read time and repeated strings are dictionary-encoded (categoricals in pandas)
+fao_column_types = {
+    'Area Code': pa.int32(),
+    'Item Code': pa.int32(),
+    'Element Code': pa.int32(),
+    'Year': pa.int16(),
+    'Value': pa.float64(),
+    'Area': pa.dictionary(pa.int32(), pa.string()),
+    'Item': pa.dictionary(pa.int32(), pa.string()),
+    'Element': pa.dictionary(pa.int32(), pa.string()),
+    'Unit': pa.dictionary(pa.int32(), pa.string()),
+    'Flag': pa.dictionary(pa.int32(), pa.string())
+}
+# Header names may carry stray spaces; the stripped names are given to the reader so the schema keys match
+column_names = [c.strip() for c in pd.read_csv(main_file, nrows=0).columns]
+df = pacsv.read_csv(
+    main_file,
+    read_options=pacsv.ReadOptions(column_names=column_names, skip_rows=1),
+    convert_options=pacsv.ConvertOptions(column_types=fao_column_types)
+).to_pandas()
 print(f"   Loaded {len(df):,} rows")
 
 print("\n🔧 Step 2: Cleaning column names and values...")
-# Clean column names - remove leading/trailing spaces
-df.columns = df.columns.str.strip()
-
-# Clean string columns - strip leading/trailing spaces
+# Column names were already stripped at read time
+
+def strip_categories(series):
+    """Strip surrounding whitespace from a categorical's labels, merging labels that become equal"""
+    stripped = series.cat.categories.str.strip()
+    if stripped.is_unique:
+        return series.cat.rename_categories(stripped)
+    # Re-code through the distinct stripped labels (missing values keep code -1)
+    new_codes, categories = pd.factorize(stripped)
+    codes = series.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, new_codes[codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=series.index, name=series.name)
+
+# Clean string columns - strip leading/trailing spaces on the category labels (not on every row)
 string_cols = ['Area', 'Item', 'Element', 'Unit', 'Flag']
 for col in string_cols:
     if col in df.columns:
-        df[col] = df[col].astype(str).str.strip()
+        df[col] = strip_categories(df[col])
 
 print(f"   Column names: {list(df.columns)}")
 
@@ -47,9 +93,7 @@ population_df = df[population_mask].copy()
 print(f"   Extracted {len(population_df):,} population rows")
 
 # Convert population values
-# FAO population unit is usually "1000 No" (thousands)
-population_df['Value'] = pd.to_numeric(population_df['Value'], errors='coerce')
-
+# FAO population unit is usually "1000 No" (thousands); Value is already numeric from the read schema
 # Check unit and convert
 if 'Unit' in population_df.columns:
     # Convert from thousands to actual population
@@ -80,31 +124,15 @@ else:
     population_df['population'] = population_df['Value']
     print("   No Unit column found - assuming population already in actual numbers")
 
-# Load AreaCodes for country name standardization
-print("   Loading AreaCodes for country standardization...")
-area_codes = pd.read_csv(RAW_DATA_DIR / "FoodBalanceSheets_E_AreaCodes.csv")
-area_codes.columns = area_codes.columns.str.strip()
-if 'Area' in area_codes.columns:
-    area_codes['Area'] = area_codes['Area'].str.strip().str.replace('"', '')
-area_codes = area_codes.drop_duplicates(subset=['Area Code'], keep='first')
-
-# Convert codes to numeric for joining
-population_df['Area Code'] = pd.to_numeric(population_df['Area Code'], errors='coerce')
-area_codes['Area Code'] = pd.to_numeric(area_codes['Area Code'], errors='coerce')
-
-# Join Area names to standardize country names
-population_df = population_df.merge(area_codes[['Area Code', 'Area']], on='Area Code', how='left', suffixes=('', '_standardized'))
-if 'Area_standardized' in population_df.columns:
-    population_df['country'] = population_df['Area_standardized'].fillna(population_df['Area'])
-else:
-    population_df['country'] = population_df['Area']
+# Map Area names to standardize country names
+population_df['country'] = population_df['Area Code'].map(area_lut).fillna(population_df['Area'])
 
 # Create cleaned population table
 # Ensure population is numeric before converting to int
 # Drop rows with missing population values before converting to int
 cleaned_population = pd.DataFrame({
     'country': population_df['country'],
-    'year': pd.to_numeric(population_df['Year'], errors='coerce'),
+    'year': population_df['Year'],
     'population': pd.to_numeric(population_df['population'], errors='coerce')
 })
 
@@ -121,7 +149,7 @@ print(f"   Years: {cleaned_population['year'].min():.0f} - {cleaned_population['
 
 # Save population dataset
 pop_output_file = OUTPUT_DIR / "Cleaned_FAO_Population.csv"
-cleaned_population.to_csv(pop_output_file, index=False)
+write_csv(cleaned_population, pop_output_file)
 print(f"   ✅ Saved population to: {pop_output_file}")
 
 print("\n🔧 Step 4: Removing population rows from nutrient processing...")
@@ -145,8 +173,21 @@ nutrient_patterns = [
     r'Sugar supply.*\(t\)'  # Total tonnes (will convert)
 ]
 
+def classify_strings(series, flag_patterns):
+    """Bit-flag code per row: each regex runs once per distinct string, not once per row
+    
+    flag_patterns maps a bit flag to a pattern; matching is case-insensitive ``re.search``,
+    like ``str.contains(case=False)``. Missing values get code 0.
+    """
+    compiled = [(flag, re.compile(pattern, re.IGNORECASE)) for flag, pattern in flag_patterns.items()]
+    codes = {
+        value: sum(flag for flag, regex in compiled if regex.search(value))
+        for value in series.dropna().unique()
+    }
+    return series.map(codes).fillna(0).astype(np.uint8)
+
 nutrient_pattern = '|'.join(nutrient_patterns)
-df = df[df['Element'].str.contains(nutrient_pattern, case=False, na=False, regex=True)]
+df = df[classify_strings(df['Element'], {1: nutrient_pattern}) == 1]
 print(f"   Filtered to {len(df):,} nutrient supply rows")
 
 print("\n🔧 Step 6: Loading metadata files...")
@@ -160,137 +201,156 @@ print("   Loading ElementCodes...")
 element_codes = pd.read_csv(RAW_DATA_DIR / "FoodBalanceSheets_E_Elements.csv")
 element_codes.columns = element_codes.columns.str.strip()
 print(f"   Loaded {len(element_codes):,} element codes")
+print(f"   AreaCodes already loaded ({len(area_codes):,} unique area codes)")
 
-print("   Loading AreaCodes...")
-area_codes = pd.read_csv(RAW_DATA_DIR / "FoodBalanceSheets_E_AreaCodes.csv")
-area_codes.columns = area_codes.columns.str.strip()
-if 'Area' in area_codes.columns:
-    area_codes['Area'] = area_codes['Area'].str.strip().str.replace('"', '')
-area_codes = area_codes.drop_duplicates(subset=['Area Code'], keep='first')
-print(f"   Loaded {len(area_codes):,} unique area codes")
-
-# Convert code columns to numeric for proper joining
-df['Item Code'] = pd.to_numeric(df['Item Code'], errors='coerce')
-df['Element Code'] = pd.to_numeric(df['Element Code'], errors='coerce')
-df['Area Code'] = pd.to_numeric(df['Area Code'], errors='coerce')
-
+# Convert metadata code columns to numeric for proper joining (main dataset codes are typed at read)
 item_codes['Item Code'] = pd.to_numeric(item_codes['Item Code'], errors='coerce')
 element_codes['Element Code'] = pd.to_numeric(element_codes['Element Code'], errors='coerce')
-area_codes['Area Code'] = pd.to_numeric(area_codes['Area Code'], errors='coerce')
 
 # Join metadata
 print("\n🔧 Step 7: Mapping metadata...")
+
+def standardize(df, ref, key, col):
+    """Map df[key] to ref's col by hashed lookup, falling back to df[col] where the code has no match"""
+    lut = ref.drop_duplicates(subset=[key]).set_index(key)[col]
+    df[col] = df[key].map(lut).fillna(df[col])
+    return df
+
 # Join Item names
 if 'Item' in df.columns and df['Item'].notna().any():
     print("   Item column already exists")
 else:
-    df = df.merge(item_codes[['Item Code', 'Item']], on='Item Code', how='left', suffixes=('', '_new'))
-    if 'Item_new' in df.columns:
-        df['Item'] = df['Item_new'].fillna(df['Item'])
-        df = df.drop(columns=['Item_new'])
+    df = standardize(df, item_codes, 'Item Code', 'Item')
 
 # Join Element descriptions
-df = df.merge(element_codes[['Element Code', 'Element']], on='Element Code', how='left', suffixes=('', '_standardized'))
-if 'Element_standardized' in df.columns:
-    df['Element'] = df['Element_standardized'].fillna(df['Element'])
-    df = df.drop(columns=['Element_standardized'])
-
-# Join Area names (standardize country names)
-df = df.merge(area_codes[['Area Code', 'Area']], on='Area Code', how='left', suffixes=('', '_standardized'))
-if 'Area_standardized' in df.columns:
-    df['country'] = df['Area_standardized'].fillna(df['Area'])
-else:
-    df['country'] = df['Area']
+df = standardize(df, element_codes, 'Element Code', 'Element')
+
+# Map Area names (standardize country names) with the same lookup as the population rows
+df['country'] = df['Area Code'].map(area_lut).fillna(df['Area'])
 
 print(f"   Metadata mapping complete. Rows: {len(df):,}")
 
 print("\n🔧 Step 8: Standardizing units...")
-# Convert Value to numeric
-df['Value'] = pd.to_numeric(df['Value'], errors='coerce')
-
 # Store original unit
 df['unit_original'] = df['Unit'].copy()
 
-# Create standardized unit and value columns
-df['unit_standard'] = df['Unit'].copy()
-df['value_standard'] = df['Value'].copy()
-
 # Load population data for conversions
 print("   Loading population data for per-capita conversions...")
-pop_lookup = cleaned_population.set_index(['country', 'year'])['population'].to_dict()
-
-# Function to get population for a country-year
-def get_population(country, year):
-    return pop_lookup.get((country, year), None)
-
-# Convert kg/capita/year to g/capita/day
-kg_year_mask = df['Unit'].str.contains('kg.*cap.*year', case=False, na=False, regex=True)
-if kg_year_mask.any():
-    df.loc[kg_year_mask, 'value_standard'] = df.loc[kg_year_mask, 'Value'] * 1000 / 365
-    df.loc[kg_year_mask, 'unit_standard'] = 'g/capita/day'
-    print(f"   Converted {kg_year_mask.sum():,} rows from kg/capita/year to g/capita/day")
-
-# Convert tonnes to g/capita/day using population
-tonnes_mask = df['Unit'].str.contains(r'tonnes|\(t\)', case=False, na=False, regex=True)
-if tonnes_mask.any():
-    print(f"   Converting {tonnes_mask.sum():,} rows from tonnes to g/capita/day...")
-    converted = 0
-    for idx in df[tonnes_mask].index:
-        country = df.loc[idx, 'country']
-        year = pd.to_numeric(df.loc[idx, 'Year'], errors='coerce')
-        pop = get_population(country, year)
-        if pop and pop > 0:
-            # Convert tonnes to grams: value * 1,000,000
-            total_grams = df.loc[idx, 'Value'] * 1_000_000
-            # Convert to per-capita per-day: (total_grams / population) / 365
-            df.loc[idx, 'value_standard'] = (total_grams / pop) / 365
-            df.loc[idx, 'unit_standard'] = 'g/capita/day'
-            converted += 1
-    print(f"   Successfully converted {converted:,} rows using population data")
-
-# Convert total kcal to kcal/capita/day
-# Only convert rows that are NOT already per-capita (exclude rows with 'cap' or 'capita' in unit)
-kcal_total_mask = (
-    df['Unit'].str.contains('kcal', case=False, na=False) & 
-    ~df['Unit'].str.contains('cap', case=False, na=False) &
-    ~df['unit_standard'].str.contains('kcal.*cap', case=False, na=False, regex=True)
-)
-if kcal_total_mask.any():
-    print(f"   Converting {kcal_total_mask.sum():,} rows from total kcal to kcal/capita/day...")
-    converted = 0
-    for idx in df[kcal_total_mask].index:
-        country = df.loc[idx, 'country']
-        year = pd.to_numeric(df.loc[idx, 'Year'], errors='coerce')
-        pop = get_population(country, year)
-        unit = str(df.loc[idx, 'Unit']).lower()
-        value = df.loc[idx, 'Value']
-        
-        if pop and pop > 0:
-            # Handle "million Kcal" - convert to total kcal first
-            if 'million' in unit:
-                total_kcal = value * 1_000_000
-            else:
-                # Assume already in total kcal
-                total_kcal = value
-            
-            # Convert total kcal to per-capita per-day: (total_kcal / population) / 365
-            df.loc[idx, 'value_standard'] = (total_kcal / pop) / 365
-            df.loc[idx, 'unit_standard'] = 'kcal/capita/day'
-            converted += 1
-    print(f"   Successfully converted {converted:,} rows using population data")
-
-# Handle rows that are already in per-capita per-day format (don't convert them)
-# These should keep their original values
-already_per_capita = (
-    df['Unit'].str.contains('kcal.*cap', case=False, na=False, regex=True) |
-    df['Unit'].str.contains('g/cap', case=False, na=False, regex=True)
-)
-df.loc[already_per_capita, 'value_standard'] = df.loc[already_per_capita, 'Value']
-df.loc[already_per_capita, 'unit_standard'] = df.loc[already_per_capita, 'Unit']
+# Population as a Series indexed by (country, year); one aligned join attaches it to every row
+pop_s = cleaned_population.set_index(['country', 'year'])['population']
+df['year'] = df['Year']
+df = df.join(pop_s.rename('population'), on=['country', 'year'])
+
+# Classify each distinct unit string once; the masks below are then integer bit tests
+UNIT_KG_YEAR, UNIT_TONNES, UNIT_KCAL, UNIT_CAP, UNIT_KCAL_CAP, UNIT_G_CAP, UNIT_MILLION = 1, 2, 4, 8, 16, 32, 64
+unit_code = classify_strings(df['Unit'], {
+    UNIT_KG_YEAR: 'kg.*cap.*year',
+    UNIT_TONNES: r'tonnes|\(t\)',
+    UNIT_KCAL: 'kcal',
+    UNIT_CAP: 'cap',
+    UNIT_KCAL_CAP: 'kcal.*cap',
+    UNIT_G_CAP: 'g/cap',
+    UNIT_MILLION: 'million'
+}).to_numpy()
+
+def has_unit(flag):
+    """Boolean mask of rows whose unit matched the given flag"""
+    return (unit_code & flag) != 0
+
+# Work on plain arrays and write the standardized columns back once at the end
+# (avoids a pandas indexer round-trip for every masked read and write)
+value = df['Value'].to_numpy(dtype=np.float64)
+unit = df['Unit'].to_numpy(dtype=object)
+population = df['population'].to_numpy(dtype=np.float64)
+
+# Check if numba is available for the fused unit-conversion kernel
+try:
+    from numba import njit, prange
+    numba_available = True
+except ImportError:
+    numba_available = False
+
+if numba_available:
+    @njit(parallel=True, cache=True)
+    def convert_units(value, population, unit_code):
+        """Apply all unit conversions in one pass; target is 0 (keep Unit), 1 (g/capita/day) or 2 (kcal/capita/day)"""
+        n = value.shape[0]
+        out = value.copy()
+        target = np.zeros(n, dtype=np.uint8)
+        for i in prange(n):
+            code = unit_code[i]
+            p = population[i]
+            if code & UNIT_KG_YEAR:
+                out[i] = value[i] * 1000 / 365
+                target[i] = 1
+            if (code & UNIT_TONNES) and p > 0:
+                out[i] = value[i] * 1_000_000 / p / 365
+                target[i] = 1
+            if (code & UNIT_KCAL) and not (code & UNIT_CAP) and p > 0:
+                total_kcal = value[i] * 1_000_000 if code & UNIT_MILLION else value[i]
+                out[i] = total_kcal / p / 365
+                target[i] = 2
+            # Rows already in per-capita per-day format keep their original values
+            if code & (UNIT_KCAL_CAP | UNIT_G_CAP):
+                out[i] = value[i]
+                target[i] = 0
+        return out, target
+
+    # Convert all rows with the compiled kernel (population was joined per row above)
+    value_standard, target = convert_units(value, population, unit_code)
+    unit_standard = unit.copy()
+    unit_standard[target == 1] = 'g/capita/day'
+    unit_standard[target == 2] = 'kcal/capita/day'
+    print(f"   Converted {(target == 1).sum():,} rows to g/capita/day and {(target == 2).sum():,} rows to kcal/capita/day")
+else:
+    has_population = population > 0
+    value_standard = value.copy()
+    unit_standard = unit.copy()
+
+    # Convert kg/capita/year to g/capita/day
+    kg_year_mask = has_unit(UNIT_KG_YEAR)
+    if kg_year_mask.any():
+        value_standard[kg_year_mask] = value[kg_year_mask] * 1000 / 365
+        unit_standard[kg_year_mask] = 'g/capita/day'
+        print(f"   Converted {kg_year_mask.sum():,} rows from kg/capita/year to g/capita/day")
+
+    # Convert tonnes to g/capita/day using population
+    tonnes_mask = has_unit(UNIT_TONNES)
+    if tonnes_mask.any():
+        print(f"   Converting {tonnes_mask.sum():,} rows from tonnes to g/capita/day...")
+        convert_mask = tonnes_mask & has_population
+        # Convert tonnes to grams (value * 1,000,000), then to per-capita per-day: (total_grams / population) / 365
+        value_standard[convert_mask] = value[convert_mask] * 1_000_000 / population[convert_mask] / 365
+        unit_standard[convert_mask] = 'g/capita/day'
+        print(f"   Successfully converted {convert_mask.sum():,} rows using population data")
+
+    # Convert total kcal to kcal/capita/day
+    # Only convert rows that are NOT already per-capita (exclude rows with 'cap' or 'capita' in unit;
+    # rows converted above now read 'g/capita/day', which never matches 'kcal')
+    kcal_total_mask = has_unit(UNIT_KCAL) & ~has_unit(UNIT_CAP)
+    if kcal_total_mask.any():
+        print(f"   Converting {kcal_total_mask.sum():,} rows from total kcal to kcal/capita/day...")
+        convert_mask = kcal_total_mask & has_population
+        # Handle "million Kcal" - convert to total kcal first; otherwise assume already in total kcal
+        total_kcal = np.where(has_unit(UNIT_MILLION), value * 1_000_000, value)
+        # Convert total kcal to per-capita per-day: (total_kcal / population) / 365
+        value_standard[convert_mask] = total_kcal[convert_mask] / population[convert_mask] / 365
+        unit_standard[convert_mask] = 'kcal/capita/day'
+        print(f"   Successfully converted {convert_mask.sum():,} rows using population data")
+
+    # Handle rows that are already in per-capita per-day format (don't convert them)
+    # These should keep their original values
+    already_per_capita = has_unit(UNIT_KCAL_CAP) | has_unit(UNIT_G_CAP)
+    value_standard[already_per_capita] = value[already_per_capita]
+    unit_standard[already_per_capita] = unit[already_per_capita]
+
+df['unit_standard'] = unit_standard
+df['value_standard'] = value_standard
 
 # Standardize unit names to consistent format
-kcal_mask = df['unit_standard'].str.contains('kcal.*cap', case=False, na=False, regex=True)
-g_mask = df['unit_standard'].str.contains('g.*cap', case=False, na=False, regex=True)
+standard_code = classify_strings(df['unit_standard'], {1: 'kcal.*cap', 2: 'g.*cap'})
+kcal_mask = (standard_code & 1) != 0
+g_mask = (standard_code & 2) != 0
 
 df.loc[kcal_mask, 'unit_standard'] = 'kcal/capita/day'
 df.loc[g_mask, 'unit_standard'] = 'g/capita/day'
@@ -322,7 +382,9 @@ def map_element_name(element):
             return value
     return element_str
 
-df['element'] = df['Element'].apply(map_element_name)
+# Resolve each distinct element name once, then map rows through the lookup
+element_lookup = {element: map_element_name(element) for element in df['Element'].unique()}
+df['element'] = df['Element'].map(element_lookup).astype('category')
 
 print("\n🔧 Step 10: Adding food group mapping (placeholder)...")
 # TODO: Create proper food group mapping from diet composition file or item codes
@@ -334,7 +396,7 @@ print("\n🔧 Step 11: Creating final cleaned nutrient dataset...")
 # Create the final cleaned dataset with all required columns
 cleaned_nutrients = pd.DataFrame({
     'country': df['country'],
-    'year': pd.to_numeric(df['Year'], errors='coerce'),
+    'year': df['Year'],
     'item': df['Item'],
     'item_code': df['Item Code'],
     'food_group': df['food_group'],
@@ -369,7 +431,7 @@ print(f"   Items: {cleaned_nutrients['item'].nunique()}")
 
 print("\n💾 Saving cleaned datasets...")
 nutrients_output_file = OUTPUT_DIR / "Cleaned_FAO_Nutrients.csv"
-cleaned_nutrients.to_csv(nutrients_output_file, index=False)
+write_csv(cleaned_nutrients, nutrients_output_file)
 print(f"   ✅ Saved nutrients to: {nutrients_output_file}")
 print(f"   File size: {nutrients_output_file.stat().st_size / (1024*1024):.2f} MB")
 
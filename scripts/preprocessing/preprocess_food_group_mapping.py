@@ -24,15 +24,35 @@ print("=" * 60)
 
 print("\n🔧 Step 1: Loading datasets...")
 # Load full item list from cleaned nutrients (most comprehensive)
-try:
-    nutrients = pd.read_csv(CLEANED_DIR / "Cleaned_FAO_Nutrients.csv", usecols=['item', 'item_code'])
-    items_df = nutrients[['item', 'item_code']].drop_duplicates()
+# The distinct (item, item_code) pairs are kept in NUTRIENT_ITEMS and reused in Step 6
+NUTRIENT_ITEMS = None
+nutrients_file = CLEANED_DIR / "Cleaned_FAO_Nutrients.csv"
+if nutrients_file.exists():
+    nutrient_columns = pd.read_csv(nutrients_file, nrows=0).columns
+    assert {'item', 'item_code'}.issubset(nutrient_columns), \
+        f"{nutrients_file} is missing 'item'/'item_code' columns (found: {list(nutrient_columns)})"
+    NUTRIENT_ITEMS = pd.read_csv(
+        nutrients_file,
+        usecols=['item', 'item_code'],
+        dtype={'item': 'string', 'item_code': 'Int64'},
+        engine='pyarrow'
+    ).drop_duplicates()
+    items_df = NUTRIENT_ITEMS.copy()
     print(f"   Loaded {len(items_df):,} items from cleaned nutrients dataset")
-except:
+else:
     # Fallback: load from raw dataset
     main_file = FOODBALANCE_DIR / "FoodBalanceSheets_E_All_Data_(Normalized).csv"
     print("   Loading FAO main dataset (sample)...")
-    df_sample = pd.read_csv(main_file, nrows=100000, low_memory=False)
+    # Only parse the two item columns; header names may carry stray spaces, so match them on the stripped name
+    sample_dtypes = {'Item Code': 'Int32', 'Item': 'string'}
+    header = pd.read_csv(main_file, nrows=0).columns
+    usecols = [c for c in header if c.strip() in sample_dtypes]
+    df_sample = pd.read_csv(
+        main_file,
+        nrows=100000,
+        usecols=usecols,
+        dtype={c: sample_dtypes[c.strip()] for c in usecols}
+    )
     df_sample.columns = df_sample.columns.str.strip()
     items_df = df_sample[['Item Code', 'Item']].drop_duplicates()
     items_df = items_df.rename(columns={'Item': 'item', 'Item Code': 'item_code'})
@@ -45,21 +65,31 @@ item_codes = pd.read_csv(item_codes_file)
 item_codes.columns = item_codes.columns.str.strip()
 print(f"   Loaded {len(item_codes):,} item codes from metadata")
 
+# Keep one row per item code so every later step works on fewer rows
+# (first name wins; rows without a code are all kept)
+items_df['item'] = items_df['item'].str.strip()
+items_df = items_df[items_df['item_code'].isna() | ~items_df.duplicated(subset=['item_code'])]
+item_codes = item_codes.drop_duplicates(subset=['Item Code'], keep='first')
+
 # Clean item names
-def clean_item_name(item):
-    """Clean and normalize item names"""
-    if pd.isna(item):
-        return None
-    item = str(item).strip()
-    # Remove trailing parentheses and text after commas if needed
-    item = re.sub(r'\s*\([^)]*\)\s*$', '', item)  # Remove trailing (text)
-    item = re.sub(r',\s*[^,]*$', '', item)  # Remove text after last comma
-    # Replace multiple spaces with single space
-    item = re.sub(r'\s+', ' ', item)
-    return item.strip()
-
-items_df['item'] = items_df['item'].apply(clean_item_name)
-item_codes['Item'] = item_codes['Item'].apply(clean_item_name)
+# Patterns are compiled once and applied to whole columns by pandas' vectorized string methods
+TRAILING_PARENS_RE = re.compile(r'\s*\([^)]*\)\s*$')  # Remove trailing (text)
+AFTER_LAST_COMMA_RE = re.compile(r',\s*[^,]*$')  # Remove text after last comma
+MULTI_SPACE_RE = re.compile(r'\s+')  # Replace multiple spaces with single space
+
+def clean_item_names(items):
+    """Clean and normalize a Series of item names (missing names stay missing)"""
+    cleaned = (
+        items.astype(str).str.strip()
+        .str.replace(TRAILING_PARENS_RE, '', regex=True)
+        .str.replace(AFTER_LAST_COMMA_RE, '', regex=True)
+        .str.replace(MULTI_SPACE_RE, ' ', regex=True)
+        .str.strip()
+    )
+    return cleaned.where(items.notna(), None)
+
+items_df['item'] = clean_item_names(items_df['item'])
+item_codes['Item'] = clean_item_names(item_codes['Item'])
 
 print("\n🔧 Step 2: Creating food group mapping rules...")
 # Define food group mapping rules based on item names
@@ -122,121 +152,89 @@ food_group_rules = {
     ]
 }
 
-def map_item_to_food_group(item):
-    """Map item name to food group based on keywords"""
-    if pd.isna(item):
-        return 'Other'
-    
-    item_lower = str(item).lower()
-    
-    # Special cases first (more specific)
-    if 'grand total' in item_lower or item_lower == 'total':
-        return None  # Don't assign food group to totals
-    
-    # Check for specific patterns
-    if 'butter' in item_lower or 'ghee' in item_lower:
-        if 'oil' not in item_lower:
-            return 'Dairy & Eggs'
-        else:
-            return 'Oils & Fats'
-    
-    if 'offal' in item_lower:
-        return 'Meat'
-    
-    if 'fish' in item_lower and 'oil' in item_lower:
-        return 'Oils & Fats'
-    
-    if 'milk' in item_lower and 'butter' not in item_lower:
-        return 'Dairy & Eggs'
-    
-    if 'grape' in item_lower and 'wine' in item_lower:
-        return 'Alcoholic Beverages'
-    if 'grape' in item_lower and 'excl' in item_lower:
-        return 'Fruit and Vegetables'
-    
-    if 'beverage' in item_lower:
-        if 'alcohol' in item_lower or 'fermented' in item_lower:
-            return 'Alcoholic Beverages'
-        else:
-            return 'Beverages'
-    
-    # Check each food group's keywords
-    for food_group, keywords in food_group_rules.items():
-        for keyword in keywords:
-            if keyword in item_lower:
-                # Additional checks for ambiguous cases
-                if keyword == 'butter' and 'oil' in item_lower:
-                    continue  # Skip, handled above
-                if keyword == 'milk' and 'butter' in item_lower:
-                    continue  # Skip, handled above
-                return food_group
-    
-    # Generic fallbacks
-    if 'animal product' in item_lower:
-        if 'fat' in item_lower:
-            return 'Oils & Fats'
-        return 'Meat'
-    if 'vegetal product' in item_lower:
-        return 'Fruit and Vegetables'
-    
-    # Handle "Other" items - try to infer from context
-    if ', other' in item_lower or 'other' in item_lower or 'others' in item_lower:
-        # Try to infer from the main category
-        if 'aquatic' in item_lower or 'fish' in item_lower or 'marine' in item_lower or 'seafood' in item_lower:
-            return 'Aquatic Products'
-        if 'citrus' in item_lower or 'fruit' in item_lower or 'fruits' in item_lower:
-            return 'Fruit and Vegetables'
-        if 'cereal' in item_lower:
-            return 'Cereals'
-        if 'meat' in item_lower:
-            return 'Meat'
-        if 'mollusc' in item_lower:
-            return 'Aquatic Products'
-        if 'oil' in item_lower or 'oilcrop' in item_lower:
-            return 'Oils & Fats'
-        if 'pulse' in item_lower:
-            return 'Pulses'
-        if 'root' in item_lower:
-            return 'Starchy Roots'
-        if 'spice' in item_lower:
-            return 'Spices & Herbs'
-        if 'vegetable' in item_lower:
-            return 'Fruit and Vegetables'
-        if 'sweetener' in item_lower:
-            return 'Sugar'
-    
-    # Handle specific item name variations
-    if 'butter, ghee' in item_lower or 'ghee' in item_lower:
-        return 'Dairy & Eggs'
-    if 'beverages, alcoholic' in item_lower or 'beverages, fermented' in item_lower:
-        return 'Alcoholic Beverages'
-    if 'grapes and products (excl wine)' in item_lower:
-        return 'Fruit and Vegetables'
-    if 'lemons, limes' in item_lower:
-        return 'Fruit and Vegetables'
-    if 'oranges, mandarines' in item_lower:
-        return 'Fruit and Vegetables'
-    if 'offals, edible' in item_lower or 'offal' in item_lower:
-        return 'Meat'
-    if 'olives (including preserved)' in item_lower or 'olive' in item_lower:
-        if 'oil' in item_lower:
-            return 'Oils & Fats'
-        return 'Fruit and Vegetables'
-    if 'tea (including mate)' in item_lower:
-        return 'Beverages'
-    if 'sugar (raw equivalent)' in item_lower:
-        return 'Sugar'
-    if 'fats, animals, raw' in item_lower:
-        return 'Oils & Fats'
-    if 'fish, body oil' in item_lower or 'fish, liver oil' in item_lower:
-        return 'Oils & Fats'
-    if 'fish, seafood' in item_lower:
-        return 'Aquatic Products'
-    
-    return 'Other'
+# One alternation regex per food group, evaluated over whole columns by the C regex engine
+food_group_patterns = {
+    food_group: re.compile('|'.join(re.escape(keyword) for keyword in keywords))
+    for food_group, keywords in food_group_rules.items()
+}
+
+def map_food_groups(items):
+    """Map a Series of item names to food groups (None for totals, 'Other' for missing names)"""
+    # Lowercase the column once; every keyword test below reuses it
+    lower = items.astype('string').str.lower()
+    masks = {}
+
+    def has(keyword):
+        """Boolean mask of item names containing keyword (computed once per keyword)"""
+        if keyword not in masks:
+            masks[keyword] = lower.str.contains(keyword, regex=False, na=False).to_numpy(dtype=bool)
+        return masks[keyword]
+
+    butter = has('butter') | has('ghee')
+    beverage = has('beverage')
+    animal_product = has('animal product')
+    olive = has('olives (including preserved)') | has('olive')
+    # ", other" and "others" both contain "other"
+    other = has('other')
+
+    # (condition, food group) in priority order - the first matching rule wins
+    rules = [
+        (items.isna().to_numpy(), 'Other'),
+        # Special cases first (more specific); don't assign food group to totals
+        (has('grand total') | (lower == 'total').to_numpy(dtype=bool, na_value=False), None),
+        (butter & ~has('oil'), 'Dairy & Eggs'),
+        (butter, 'Oils & Fats'),
+        (has('offal'), 'Meat'),
+        (has('fish') & has('oil'), 'Oils & Fats'),
+        (has('milk') & ~has('butter'), 'Dairy & Eggs'),
+        (has('grape') & has('wine'), 'Alcoholic Beverages'),
+        (has('grape') & has('excl'), 'Fruit and Vegetables'),
+        (beverage & (has('alcohol') | has('fermented')), 'Alcoholic Beverages'),
+        (beverage, 'Beverages'),
+        # Each food group's keywords, in rule order
+        # (butter/ghee and milk items are already matched above, so no keyword exclusions are needed)
+        *[
+            (lower.str.contains(pattern, regex=True, na=False).to_numpy(dtype=bool), food_group)
+            for food_group, pattern in food_group_patterns.items()
+        ],
+        # Generic fallbacks
+        (animal_product & has('fat'), 'Oils & Fats'),
+        (animal_product, 'Meat'),
+        (has('vegetal product'), 'Fruit and Vegetables'),
+        # "Other" items - infer from the main category
+        (other & (has('aquatic') | has('fish') | has('marine') | has('seafood')), 'Aquatic Products'),
+        (other & (has('citrus') | has('fruit')), 'Fruit and Vegetables'),
+        (other & has('cereal'), 'Cereals'),
+        (other & has('meat'), 'Meat'),
+        (other & has('mollusc'), 'Aquatic Products'),
+        (other & has('oil'), 'Oils & Fats'),
+        (other & has('pulse'), 'Pulses'),
+        (other & has('root'), 'Starchy Roots'),
+        (other & has('spice'), 'Spices & Herbs'),
+        (other & has('vegetable'), 'Fruit and Vegetables'),
+        (other & has('sweetener'), 'Sugar'),
+        # Specific item name variations
+        (has('butter, ghee') | has('ghee'), 'Dairy & Eggs'),
+        (has('beverages, alcoholic') | has('beverages, fermented'), 'Alcoholic Beverages'),
+        (has('grapes and products (excl wine)'), 'Fruit and Vegetables'),
+        (has('lemons, limes'), 'Fruit and Vegetables'),
+        (has('oranges, mandarines'), 'Fruit and Vegetables'),
+        (has('offals, edible') | has('offal'), 'Meat'),
+        (olive & has('oil'), 'Oils & Fats'),
+        (olive, 'Fruit and Vegetables'),
+        (has('tea (including mate)'), 'Beverages'),
+        (has('sugar (raw equivalent)'), 'Sugar'),
+        (has('fats, animals, raw'), 'Oils & Fats'),
+        (has('fish, body oil') | has('fish, liver oil'), 'Oils & Fats'),
+        (has('fish, seafood'), 'Aquatic Products'),
+    ]
+    condlist = [condition for condition, _ in rules]
+    choicelist = [np.full(len(items), food_group, dtype=object) for _, food_group in rules]
+    groups = np.select(condlist, choicelist, default='Other')
+    return pd.Series(groups, index=items.index, dtype=object)
 
 print("\n🔧 Step 3: Applying food group mapping...")
-items_df['food_group'] = items_df['item'].apply(map_item_to_food_group)
+items_df['food_group'] = map_food_groups(items_df['item'])
 
 # Remove items without food groups (like "Grand Total")
 items_df = items_df[items_df['food_group'].notna()]
@@ -247,26 +245,16 @@ print(items_df['food_group'].value_counts().sort_index())
 
 print("\n🔧 Step 4: Merging with ItemCodes metadata...")
 # Merge with ItemCodes to ensure we have correct item codes
-# Convert item codes to numeric
-items_df['item_code'] = pd.to_numeric(items_df['item_code'], errors='coerce')
-item_codes['Item Code'] = pd.to_numeric(item_codes['Item Code'], errors='coerce')
+# Convert item codes to nullable integers so both sides share an exact integer join key
+items_df['item_code'] = pd.to_numeric(items_df['item_code'], errors='coerce').astype('Int64')
+item_meta = item_codes[['Item Code', 'Item']].rename(columns={'Item Code': 'item_code', 'Item': 'item_meta'})
+item_meta['item_code'] = pd.to_numeric(item_meta['item_code'], errors='coerce').astype('Int64')
 
 # Try to merge on item code first
-mapping_df = items_df.merge(
-    item_codes[['Item Code', 'Item']],
-    left_on='item_code',
-    right_on='Item Code',
-    how='left',
-    suffixes=('', '_metadata')
-)
+mapping_df = items_df.merge(item_meta, on='item_code', how='left')
 
 # If item name from metadata is different, use it (it's more authoritative)
-if 'Item_metadata' in mapping_df.columns:
-    mapping_df['item'] = mapping_df['Item_metadata'].fillna(mapping_df['item'])
-    mapping_df = mapping_df.drop(columns=['Item_metadata', 'Item Code'])
-
-# Clean item names again after merge
-mapping_df['item'] = mapping_df['item'].apply(clean_item_name)
+mapping_df['item'] = mapping_df.pop('item_meta').fillna(mapping_df['item'])
 
 print(f"   Final mapping has {len(mapping_df):,} rows")
 
@@ -292,73 +280,65 @@ food_group_standardization = {
 mapping_df['food_group'] = mapping_df['food_group'].map(food_group_standardization).fillna('Other')
 
 print("\n🔧 Step 6: Ensuring all items from nutrients are included...")
-# Get all items from nutrients dataset
-try:
-    nutrients = pd.read_csv(CLEANED_DIR / "Cleaned_FAO_Nutrients.csv", usecols=['item', 'item_code'])
-    all_nutrient_items = nutrients[['item', 'item_code']].drop_duplicates()
+# Get all items from nutrients dataset (already loaded in Step 1)
+if NUTRIENT_ITEMS is not None:
+    all_nutrient_items = NUTRIENT_ITEMS
     
     # Find missing items (before cleaning to preserve original names)
     mapped_item_set = set(mapping_df['item'].unique())
-    missing_items = all_nutrient_items[~all_nutrient_items['item'].isin(mapped_item_set)].copy()
+    missing_items = all_nutrient_items[~all_nutrient_items['item'].isin(mapped_item_set)]
     
     if len(missing_items) > 0:
         print(f"   Found {len(missing_items)} items not yet mapped, mapping them now...")
         
         # First, try to map based on similar items already in mapping
+        similarity_stopwords = {'other', 'others', 'products', 'including'}
+
+        def significant_words(name):
+            """Base words of an item name (ignore short words and "other", "others", etc.)"""
+            return {w for w in str(name).lower().split() if len(w) > 3 and w not in similarity_stopwords}
+
+        # Inverted index: word -> (position, food group) of the first mapped item containing it
+        word_index = {}
+        for position, (mapped_item, food_group) in enumerate(zip(mapping_df['item'], mapping_df['food_group'])):
+            for word in significant_words(mapped_item):
+                word_index.setdefault(word, (position, food_group))
+
         def find_similar_food_group(item_name):
-            """Find food group by matching with similar items"""
-            item_lower = str(item_name).lower()
-            
-            # Check if it's a variation of an existing mapped item
-            for mapped_item, food_group in zip(mapping_df['item'], mapping_df['food_group']):
-                mapped_lower = str(mapped_item).lower()
-                # Extract base words (ignore "other", "others", etc.)
-                item_words = set([w for w in item_lower.split() if len(w) > 3 and w not in ['other', 'others', 'products', 'including']])
-                mapped_words = set([w for w in mapped_lower.split() if len(w) > 3 and w not in ['other', 'others', 'products', 'including']])
-                
-                # If significant word overlap, use same food group
-                if item_words and mapped_words and len(item_words & mapped_words) >= 1:
-                    return food_group
-            
-            return None
+            """Find food group of the first mapped item sharing a significant word with item_name"""
+            hits = [word_index[w] for w in significant_words(item_name) if w in word_index]
+            return min(hits)[1] if hits else None
+
+        # Try to map missing items: similar mapped item first, then the mapping rules
+        # (the rules give None for Grand Total rows, which get no food group)
+        rule_food_groups = map_food_groups(missing_items['item']).to_numpy()
+        missing_food_groups = pd.Series([
+            None if rule_group is None
+            else find_similar_food_group(item_name) or rule_group
+            for item_name, rule_group in zip(missing_items['item'].to_numpy(), rule_food_groups)
+        ], index=missing_items.index, dtype=object)
         
-        # Try to map missing items
-        for idx, row in missing_items.iterrows():
-            item_name = row['item']
-            # Skip Grand Total
-            if 'grand total' in str(item_name).lower() or str(item_name).lower() == 'total':
-                continue
-            
-            # Try to find similar food group first
-            similar_group = find_similar_food_group(item_name)
-            if similar_group:
-                missing_items.loc[idx, 'food_group'] = similar_group
-            else:
-                # Use the mapping function
-                missing_items.loc[idx, 'food_group'] = map_item_to_food_group(item_name)
+        # Remove items without food groups, then build the new rows in one frame
+        # (item names cleaned for consistency)
+        has_group = missing_food_groups.notna()
+        missing_rows = pd.DataFrame({
+            'item': clean_item_names(missing_items['item'][has_group]),
+            'item_code': missing_items['item_code'][has_group],
+            'food_group': missing_food_groups[has_group]
+        })
         
-        # Clean item names for consistency
-        missing_items['item'] = missing_items['item'].apply(clean_item_name)
-        
-        # Remove items without food groups
-        missing_items = missing_items[missing_items['food_group'].notna()]
-        
-        if len(missing_items) > 0:
-            # Merge with existing mapping
-            mapping_df = pd.concat([mapping_df, missing_items], ignore_index=True)
-            print(f"   Added {len(missing_items)} additional items")
-except Exception as e:
-    print(f"   Could not load nutrients dataset: {e}")
+        if len(missing_rows) > 0:
+            # Merge with existing mapping in a single concat
+            mapping_df = pd.concat([mapping_df, missing_rows], ignore_index=True)
+            print(f"   Added {len(missing_rows)} additional items")
+else:
+    print("   Nutrients dataset was not loaded in Step 1, skipping")
 
 print("\n🔧 Step 7: Removing duplicates...")
-# Remove duplicates based on (item, food_group)
-# If same item maps to multiple food groups, keep the most specific one
-initial_count = len(mapping_df)
-mapping_df = mapping_df.drop_duplicates(subset=['item', 'food_group'], keep='first')
-
-# If an item still appears multiple times with different food groups, 
+# If an item appears multiple times with different food groups,
 # prioritize more specific groups over "Other"
-mapping_df = mapping_df.sort_values('food_group', key=lambda x: x.map({
+initial_count = len(mapping_df)
+food_group_priority = {
     'Other': 999,  # Lowest priority
     'Beverages': 8,
     'Spices & Herbs': 7,
@@ -373,9 +353,13 @@ mapping_df = mapping_df.sort_values('food_group', key=lambda x: x.map({
     'Starchy Roots': 2,
     'Pulses': 2,
     'Cereals': 1  # Highest priority for cereals
-}))
+}
 
-mapping_df = mapping_df.drop_duplicates(subset=['item'], keep='first')
+# Keep one row per item: the first row with the best (lowest) priority, found by a hash groupby
+mapping_df = mapping_df.reset_index(drop=True)
+priority = mapping_df['food_group'].map(food_group_priority).fillna(999)
+best_rows = priority.groupby(mapping_df['item'], sort=False, dropna=False).idxmin()
+mapping_df = mapping_df.loc[best_rows.to_numpy()]
 
 if len(mapping_df) < initial_count:
     print(f"   Removed {initial_count - len(mapping_df):,} duplicate mappings")
@@ -391,6 +375,9 @@ final_mapping = pd.DataFrame({
 })
 
 # Sort by food group and item name
+# (food_group as an ordered categorical, so the sort compares integer codes; categories are alphabetical)
+food_group_dtype = pd.CategoricalDtype(sorted(final_mapping['food_group'].unique()), ordered=True)
+final_mapping['food_group'] = final_mapping['food_group'].astype(food_group_dtype)
 final_mapping = final_mapping.sort_values(['food_group', 'item']).reset_index(drop=True)
 
 # Show summary
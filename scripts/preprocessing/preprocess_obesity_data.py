@@ -6,6 +6,7 @@ Creates a clean country-year obesity dataset
 import pandas as pd
 import numpy as np
 from pathlib import Path
+from rapidfuzz import process, fuzz
 
 # Set paths
 BASE_DIR = Path(__file__).parent.parent.parent  # Go up to project root
@@ -20,9 +21,27 @@ print("WHO OBESITY DATA PREPROCESSING")
 print("=" * 60)
 
 print("\n🔧 Step 1: Loading dataset...")
-# Load the dataset
+# Load the dataset (Arrow's multi-threaded parser), only parsing the columns used below
 obesity_file = RAW_DATA_DIR / "data.csv"
-df = pd.read_csv(obesity_file, low_memory=False)
+who_dtypes = {
+    'Indicator': 'string',
+    'Dim1': 'category',
+    'Dim2': 'category',
+    'Location': 'string',
+    'SpatialDimValueCode': 'string',
+    'Period': 'Int32',
+    'FactValueNumeric': 'float64',
+    'Value': 'string'
+}
+# Header names may carry stray spaces (stripped in Step 2), so match them on the stripped name
+header = pd.read_csv(obesity_file, nrows=0).columns
+usecols = [c for c in header if c.strip() in who_dtypes]
+df = pd.read_csv(
+    obesity_file,
+    usecols=usecols,
+    dtype={c: who_dtypes[c.strip()] for c in usecols},
+    engine='pyarrow'
+)
 print(f"   Loaded {len(df):,} rows")
 
 print("\n🔧 Step 2: Cleaning column names...")
@@ -31,12 +50,9 @@ df.columns = df.columns.str.strip()
 print(f"   Column names: {list(df.columns)[:10]}...")
 
 print("\n🔧 Step 3: Filtering for correct indicator...")
-# Filter for obesity indicator - contains "obesity" AND "BMI"
+# Filter for obesity indicator - contains "obesity" AND "BMI" (two lookaheads, one pass over the column)
 initial_count = len(df)
-obesity_mask = (
-    df['Indicator'].str.contains('obesity', case=False, na=False) &
-    df['Indicator'].str.contains('BMI', case=False, na=False)
-)
+obesity_mask = df['Indicator'].str.contains(r'(?=.*obesity)(?=.*bmi)', case=False, regex=True, na=False)
 df = df[obesity_mask]
 print(f"   Filtered to {len(df):,} rows (removed {initial_count - len(df):,} rows)")
 print(f"   Unique indicators: {df['Indicator'].unique()}")
@@ -52,10 +68,7 @@ print("\n🔧 Step 5: Filtering for adults (Age Group)...")
 if 'Dim2' in df.columns:
     initial_count = len(df)
     # Filter for "18+" or "Adults" in age group
-    age_mask = (
-        df['Dim2'].str.contains('18', case=False, na=False) |
-        df['Dim2'].str.contains('adult', case=False, na=False)
-    )
+    age_mask = df['Dim2'].str.contains(r'18|adult', case=False, regex=True, na=False)
     df = df[age_mask]
     print(f"   Filtered to {len(df):,} rows (removed {initial_count - len(df):,} rows)")
     print(f"   Age groups: {df['Dim2'].unique()}")
@@ -86,15 +99,15 @@ cleaned_df = pd.DataFrame({
 print(f"   Selected {len(cleaned_df):,} rows with required columns")
 
 print("\n🔧 Step 7: Cleaning values...")
-# Convert year to integer
-cleaned_df['year'] = pd.to_numeric(cleaned_df['year'], errors='coerce')
-
-# Convert obesity_pct to float
-cleaned_df['obesity_pct'] = pd.to_numeric(cleaned_df['obesity_pct'], errors='coerce')
-
-# Remove NA rows
+# Convert year and obesity_pct to numbers in one assign (invalid values become NA)
 initial_count = len(cleaned_df)
+cleaned_df = cleaned_df.assign(**{
+    col: pd.to_numeric(cleaned_df[col], errors='coerce') for col in ['year', 'obesity_pct']
+})
+
+# Remove NA rows in a single pass, then make year an integer
 cleaned_df = cleaned_df.dropna(subset=['country', 'year', 'obesity_pct', 'iso3'])
+cleaned_df['year'] = cleaned_df['year'].astype('Int64')
 print(f"   Removed {initial_count - len(cleaned_df):,} rows with missing values")
 print(f"   Remaining rows: {len(cleaned_df):,}")
 
@@ -106,24 +119,32 @@ cleaned_df['country'] = cleaned_df['country'].astype(str).str.strip()
 # Load FAO country names for reference
 try:
     fao_pop = pd.read_csv(BASE_DIR / "data" / "processed" / "cleaned" / "Cleaned_FAO_Population.csv", usecols=['country'])
-    fao_countries = set(fao_pop['country'].str.strip().str.lower())
-    print(f"   Loaded {len(fao_countries)} FAO country names for reference")
+    # Lowercased FAO name -> original FAO name (first occurrence), built once
+    fao_names = fao_pop['country'].dropna().drop_duplicates()
+    fao_keys = fao_names.str.strip().str.lower()
+    first_key = ~fao_keys.duplicated()
+    fao_lower_to_orig = dict(zip(fao_keys[first_key], fao_names[first_key]))
+    print(f"   Loaded {len(fao_lower_to_orig)} FAO country names for reference")
     
-    # Create a mapping for common name variations
-    country_mapping = {}
-    for country in cleaned_df['country'].unique():
+    fao_choices = list(fao_lower_to_orig)
+
+    def match_fao_country(country):
+        """FAO name for a WHO country name: exact match, then a near-identical spelling, else None"""
         country_lower = str(country).lower().strip()
-        # Try to find matching FAO country name
-        for fao_country in fao_countries:
-            # Exact match
-            if country_lower == fao_country:
-                country_mapping[country] = fao_pop[fao_pop['country'].str.lower() == fao_country]['country'].iloc[0]
-                break
-            # Partial match (country name contains or is contained in FAO name)
-            elif country_lower in fao_country or fao_country in country_lower:
-                if len(country_lower) > 5 and len(fao_country) > 5:  # Avoid short matches
-                    country_mapping[country] = fao_pop[fao_pop['country'].str.lower() == fao_country]['country'].iloc[0]
-                    break
+        # Exact match
+        if country_lower in fao_lower_to_orig:
+            return fao_lower_to_orig[country_lower]
+        # Whole-string similarity (scored in C++) only accepts spelling variants such as
+        # "côte d’ivoire" / "côte d'ivoire"; subset scorers would also accept "sudan" -> "south sudan"
+        match = process.extractOne(country_lower, fao_choices, scorer=fuzz.ratio, score_cutoff=90)
+        return fao_lower_to_orig[match[0]] if match is not None else None
+
+    # Create a mapping for common name variations
+    country_mapping = {
+        country: fao_country
+        for country in cleaned_df['country'].unique()
+        if (fao_country := match_fao_country(country)) is not None
+    }
     
     # Apply mapping where available
     if country_mapping: